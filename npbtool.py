@@ -12,67 +12,286 @@
 # execution timeline, thus ignoring initialization.
 
 import argparse
+import io
 import os
+import selectors
+import shlex
 import subprocess
 import sys
-import threading
 import time
-from math import floor
 
 # set the number of OpenMP threads
 OMP_NUM_THREADS = 64
+# disjoint CPU sets for the benchmark and the profiler, so the profiler doesn't
+# migrate onto the cores being measured. If you set OMP_PLACES, keep PROF_CPUS
+# out of it to avoid oversubscribing those cores. Note that with SMT enabled,
+# Linux usually numbers CPU 64 on the 64-core EPYC 7742 as the hyperthread
+# sibling of core 0, so the profiler still shares that core's L1/L2 with
+# benchmark thread 0; every physical core hosts a benchmark thread, so there
+# is no fully isolated choice unless OMP_NUM_THREADS is lowered. Both sets are
+# checked against the CPUs actually available before anything is launched.
+BENCH_CPUS = set(range(0, OMP_NUM_THREADS))
+PROF_CPUS = {64}
 # markers to look for in the output text that delimit phases
 SPLIT_MARKER = 'Initialization time'
 MOP_S_MARKER = 'Mop/s total'
+# ...and as bytes, so they can be searched for directly in the raw output
+SPLIT_MARKER_B = SPLIT_MARKER.encode()
+MOP_S_MARKER_B = MOP_S_MARKER.encode()
+# size of each block read from the benchmark's stdout pipe
+READ_CHUNK_SIZE = 1 << 16
 # location of the AMD profiler executable
 UPROF_PCM_EXE = '/opt/AMDuProf_4.2-850/bin/AMDuProfPcm'
+# metric group to sample; only the DRAM read/write bandwidth is used downstream
+# (MEM_BW_RD_GB_S/MEM_BW_WR_GB_S in data.csv)
+UPROF_PCM_METRICS = 'memory'
+
+def cpu_list(cpus):
+    # Formats a set of CPUs as a compact list of ranges, e.g. '0-63,65', as
+    # taken by `taskset -c`.
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(f'{a}-{b}' if a != b else f'{a}' for a, b in ranges)
+
+
+def smt_siblings(cpu):
+    # The logical CPUs sharing a physical core with `cpu` (including itself),
+    # per sysfs; just {cpu} if the topology isn't available.
+    path = f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list'
+    try:
+        with open(path, 'r') as f:
+            spec = f.read().strip()
+    except OSError:
+        return {cpu}
+
+    siblings = set()
+    for part in spec.split(','):
+        first, _, last = part.partition('-')
+        siblings.update(range(int(first), int(last or first) + 1))
+    return siblings
+
+
+def check_cpus(with_profiler=False):
+    # Makes sure BENCH_CPUS (and PROF_CPUS, if the profiler will run) are all
+    # available to us, so a bad set fails here rather than partway through a run.
+    available = os.sched_getaffinity(0)
+    cpu_sets = {'BENCH_CPUS': BENCH_CPUS}
+    if with_profiler:
+        cpu_sets['PROF_CPUS'] = PROF_CPUS
+
+    for name, cpus in cpu_sets.items():
+        missing = cpus - available
+        if missing:
+            print(f"Error: {name} includes CPU(s) {cpu_list(missing)}, which are not "
+                    f"available here (available: {cpu_list(available)})")
+            sys.exit(1)
+
+    if not with_profiler:
+        return
+
+    if BENCH_CPUS & PROF_CPUS:
+        print(f"Error: BENCH_CPUS and PROF_CPUS overlap on CPU(s) "
+                f"{cpu_list(BENCH_CPUS & PROF_CPUS)}")
+        sys.exit(1)
 
-def do_time(args):
-    # set up the environment variable
-    env = os.environ.copy()
-    env['OMP_NUM_THREADS'] = str(OMP_NUM_THREADS)
+    shared = {cpu for cpu in PROF_CPUS if smt_siblings(cpu) & BENCH_CPUS}
+    if shared:
+        print(f"Warning: profiler CPU(s) {cpu_list(shared)} are SMT siblings of "
+                f"benchmark CPUs, so they share those cores' L1/L2 caches")
 
-    # kick off the benchmark process
-    process = subprocess.Popen(args.command, shell=True, stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT, text=True, env=env)
 
-    start_time = time.time()
+def find_mop_s(buf, end):
+    # Looks for MOP_S_MARKER within the complete lines in buf[:end]. Only the
+    # matched line is split (and decoded by float()). Returns None if absent, or
+    # if the line is malformed (e.g. Fortran's '****' overflow, or a short line).
+    pos = buf.find(MOP_S_MARKER_B, 0, end)
+    if pos == -1:
+        return None
 
-    initialization_duration = None
+    eol = buf.find(b'\n', pos, end)
+    try:
+        return float(buf[pos:eol if eol != -1 else end].split()[3])
+    except (ValueError, IndexError):
+        return None
+
+
+def tail_output(process, start_ns, on_split=None, split_timeout=None):
+    # Mirrors the benchmark's (merged) stdout while scanning it for both
+    # SPLIT_MARKER and MOP_S_MARKER. on_split(), if given, is called the moment
+    # initialization completes, or split_timeout seconds after start_ns if the
+    # marker hasn't shown up by then. Returns (initialization_ns, end_ns, mop_s).
+
+    # mirror the benchmark's output as raw bytes; when piped, stdout is already
+    # block-buffered, so we only force a flush at phase boundaries (or per block
+    # when a human is watching on a terminal). Anything print()ed so far must
+    # reach stdout before those raw bytes do.
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    write = out.write
+    interactive = out.isatty()
+
+    initialization_ns = None
     mop_s = None
+    end_ns = None
+
+    split_pending = on_split != None
+    split_deadline_ns = None
+    if split_timeout != None:
+        split_deadline_ns = start_ns + int(split_timeout * 1e9)
+
+    # poll the (nonblocking) pipe from this thread rather than a reader thread
+    fd = process.stdout.fileno()
+    os.set_blocking(fd, False)
+    sel = selectors.DefaultSelector()
+    sel.register(process.stdout, selectors.EVENT_READ)
+
+    # also wait on a pidfd for the benchmark, so its exit wakes us immediately
+    # and the end timestamp is exact, even if something else (e.g. a leftover
+    # child) keeps the pipe open; without pidfd support we fall back to noticing
+    # the exit on the next wakeup
+    try:
+        pidfd = os.pidfd_open(process.pid)
+        sel.register(pidfd, selectors.EVENT_READ)
+    except (AttributeError, OSError):
+        pidfd = None
+
+    # read the pipe in blocks into one reusable buffer; any partial trailing
+    # line is kept at the front of the buffer, and the next block is read in
+    # right after it
+    pipe = io.FileIO(fd, 'rb', closefd=False)
+    buf = bytearray(READ_CHUNK_SIZE)
+    mv = memoryview(buf)
+    carry = 0
+    while True:
+        # once the benchmark has exited, we're only draining what's left
+        timeout = 0.25 if end_ns == None else 0
+        if split_pending and split_deadline_ns != None:
+            remaining_ns = split_deadline_ns - time.monotonic_ns()
+            if remaining_ns <= 0:
+                split_pending = False
+                on_split()
+            else:
+                timeout = min(timeout, remaining_ns / 1e9)
+
+        events = sel.select(timeout)
+        if end_ns == None and process.poll() != None:
+            end_ns = time.monotonic_ns()
+            if pidfd != None:
+                # an exited process's pidfd stays readable; stop watching it
+                sel.unregister(pidfd)
+        if not events and end_ns == None:
+            continue
+
+        # once the benchmark has exited, keep draining whatever it left in the
+        # pipe; only when the pipe is empty (the read would block) do we treat
+        # that as EOF, rather than waiting on anything else still holding it open
+        n = pipe.readinto(mv[carry:])
+        if n == None:
+            if end_ns == None:
+                continue
+            n = 0
+        write(mv[carry:carry + n])
+
+        # only scan complete lines; hold any trailing partial line back until
+        # the next block arrives (or EOF). A single line that fills the whole
+        # buffer is scanned as-is rather than carried.
+        filled = carry + n
+        end = buf.rfind(b'\n', 0, filled) + 1 if n else filled
+        if end == 0 and filled == len(buf):
+            end = filled
+
+        if initialization_ns == None and buf.find(SPLIT_MARKER_B, 0, end) != -1:
+            initialization_ns = time.monotonic_ns() - start_ns
+            out.flush()
+            if split_pending:
+                split_pending = False
+                on_split()
+
+        if mop_s == None and (mop_s := find_mop_s(buf, end)) != None:
+            out.flush()
+
+        if interactive:
+            out.flush()
+
+        if not n:
+            break
+
+        carry = filled - end
+        buf[:carry] = buf[end:filled]
+
+    sel.close()
+    if pidfd != None:
+        os.close(pidfd)
+    process.stdout.close()
+    process.wait()
+    end_ns = end_ns or time.monotonic_ns()
 
-    # looks for both SPLIT_MARKER and MOP_S_MARKER
-    def tail_output():
-        nonlocal initialization_duration, mop_s
-        for line in process.stdout:
-            print(line, end='')
+    return initialization_ns, end_ns, mop_s
 
-            if SPLIT_MARKER in line and initialization_duration == None:
-                initialization_duration = time.time() - start_time
 
-            if MOP_S_MARKER in line and mop_s == None:
-                mop_s = float(line.split()[3])
+def run_timed(argv, env):
+    # Runs one benchmark to completion, mirroring its output, and returns
+    # ((start_ns, initialization_ns, end_ns, mop_s), exit status). Shared by
+    # `time` and `sweep`.
 
-    thread = threading.Thread(target=tail_output)
-    thread.start()
+    # kick off the benchmark process
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, env=env,
+            preexec_fn=lambda: os.sched_setaffinity(0, BENCH_CPUS))
 
-    process.wait()
-    end_time = time.time()
-    thread.join()
+    start_ns = time.monotonic_ns()
+
+    # if anything goes wrong partway through, don't leave the benchmark running
+    # (and contending for BENCH_CPUS) behind us
+    try:
+        initialization_ns, end_ns, mop_s = tail_output(process, start_ns)
+    finally:
+        if process.poll() == None:
+            process.kill()
+        process.wait()
+        process.stdout.close()
+
+    return (start_ns, initialization_ns, end_ns, mop_s), process.returncode
 
-    total_duration = end_time - start_time
 
-    initialization_duration = initialization_duration or 0.0
-    runtime_duration = total_duration - initialization_duration
+def do_time(args):
+    check_cpus()
+
+    # set up the environment variable
+    env = os.environ.copy()
+    env['OMP_NUM_THREADS'] = str(OMP_NUM_THREADS)
+
+    # run the benchmark directly rather than through an intermediate shell, so
+    # signals and the affinity mask reach the benchmark itself
+    argv = shlex.split(args.command)
+
+    timing, status = run_timed(argv, env)
+    print_timing(*timing)
+    if status != 0:
+        print(f"Warning: benchmark exited with status {status}")
+
+
+def print_timing(start_ns, initialization_ns, end_ns, mop_s):
+    # durations are kept as integer nanoseconds and only converted for display
+    total_ns = end_ns - start_ns
+
+    initialization_ns = initialization_ns or 0
+    runtime_ns = total_ns - initialization_ns
 
     print('-' * 40)
-    print(f"Initialization duration: {initialization_duration:.2f} seconds")
-    print(f"Runtime duration: {runtime_duration:.2f} seconds")
-    print(f"Total execution duration: {total_duration:.2f} seconds")
-    print(f"Mop/s: {mop_s:.2f}")
+    print(f"Initialization duration: {initialization_ns / 1e9:.2f} seconds")
+    print(f"Runtime duration: {runtime_ns / 1e9:.2f} seconds")
+    print(f"Total execution duration: {total_ns / 1e9:.2f} seconds")
+    print(f"Mop/s: {mop_s:.2f}" if mop_s != None else "Mop/s: n/a")
 
 
 def do_profile(args):
+    check_cpus(with_profiler=True)
+
     # make sure the MSR kernel module is loaded
     try:
         result = subprocess.run(["sudo", "modprobe", "msr"], check=True)
@@ -86,31 +305,96 @@ def do_profile(args):
 
     # create the profiler output directory and determine the output file path
     os.makedirs('out/', exist_ok=True)
-    benchmark_name = os.path.basename(args.command)
+    argv = shlex.split(args.command)
+    benchmark_name = os.path.basename(argv[0])
     csv_output_path = f'out/{benchmark_name}.csv'
 
-    # kick off the benchmark process
-    process = subprocess.Popen(args.command, shell=True, env=env)
+    # uProf only takes whole seconds; round rather than truncate so we don't
+    # drop up to a second of the main kernel(s), but always sample for at least
+    # one second
+    run_duration_s = max(1, round(args.run_duration))
+    profiler_command = [UPROF_PCM_EXE, '-m', UPROF_PCM_METRICS, '-a', '-d', str(run_duration_s),
+            '-o', csv_output_path]
+
+    # kick off the benchmark process, capturing its output so we can watch for
+    # the end of initialization
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, env=env,
+            preexec_fn=lambda: os.sched_setaffinity(0, BENCH_CPUS))
+
+    start_ns = time.monotonic_ns()
+
+    # start the profiler as soon as SPLIT_MARKER is printed, so its sampling
+    # window sits on the main kernel(s); benchmarks that never print the marker
+    # (e.g. bt, ep, ft, lu and sp) are instead profiled from init_duration on
+    #
+    # the profiler is spawned with posix_spawn (vfork+exec) rather than Popen's
+    # fork+exec, which is cheaper while the benchmark is busy. Nothing can run in
+    # the child before exec, so it goes through `taskset`, which pins it to
+    # PROF_CPUS before exec'ing the profiler itself. A failed spawn is reported
+    # but must not stop us draining the benchmark's output.
+    profiler_argv = ['taskset', '-c', cpu_list(PROF_CPUS)] + profiler_command
+    profiler_pid = None
+    def start_profiler():
+        nonlocal profiler_pid
+        try:
+            profiler_pid = os.posix_spawnp(profiler_argv[0], profiler_argv, os.environ)
+        except OSError as e:
+            print(f"Error starting profiler: {e}", file=sys.stderr)
+
+    tail_output(process, start_ns, on_split=start_profiler,
+            split_timeout=args.init_duration)
+
+    if profiler_pid == None:
+        print("Error: profiler was not started; no profile recorded")
+        sys.exit(1)
 
-    def run_profiler_on(command, init_duration, run_duration, csv_output_path):
-        time.sleep(init_duration)
+    _, status = os.waitpid(profiler_pid, 0)
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code != 0:
+        print(f"Error: profiler exited with status {exit_code}; no profile recorded")
+        sys.exit(1)
 
-        run_duration_s = int(floor(run_duration))
-        profiler_command = [UPROF_PCM_EXE, '-m', 'memory', '-a', '-d', str(run_duration_s),
-                '-o', csv_output_path]
+    print('-' * 40)
+    print(f"Profiling complete; output: {csv_output_path}")
 
-        # kick off the profiler process
-        subprocess.run(profiler_command)
 
-    thread = threading.Thread(target=run_profiler_on, args=(args.command,
-            args.init_duration, args.run_duration, csv_output_path))
-    thread.start()
+def do_sweep(args):
+    check_cpus()
 
-    process.wait()
-    thread.join()
+    # set up the environment variable
+    env = os.environ.copy()
+    env['OMP_NUM_THREADS'] = str(OMP_NUM_THREADS)
 
-    print('-' * 40)
-    print(f"Profiling complete; output: {csv_output_path}")
+    # one benchmark command per line; blank lines and '#' comments are skipped
+    with open(args.file, 'r') as f:
+        argvs = [argv for line in f if (argv := shlex.split(line, comments=True))]
+
+    # benchmarks run one at a time, so they don't contend for BENCH_CPUS; a
+    # benchmark that fails to launch or run is reported, and the sweep moves on
+    failed = []
+    for argv in argvs:
+        command = shlex.join(argv)
+        print('=' * 40)
+        print(f"Command: {command}")
+        try:
+            timing, status = run_timed(argv, env)
+        except Exception as e:
+            print(f"Error running {command}: {e}")
+            failed.append(command)
+            continue
+
+        print_timing(*timing)
+        if status != 0:
+            print(f"Warning: benchmark exited with status {status}")
+            failed.append(command)
+
+    if failed:
+        print('=' * 40)
+        print(f"{len(failed)} of {len(argvs)} benchmarks failed:")
+        for command in failed:
+            print(f"  {command}")
+        sys.exit(1)
 
 
 def main():
@@ -129,13 +413,23 @@ def main():
     profile_parser = subparsers.add_parser("profile",
             help="Profile the benchmark and record memory bandwidth")
     profile_parser.add_argument("-i", "--init_duration", required=True, type=float,
-            help="Duration expected for initialization phase")
+            help="Duration expected for initialization phase; profiling starts at "
+                    "the initialization marker, or after this many seconds if the "
+                    "benchmark hasn't printed it by then (use 0 if it never does)")
     profile_parser.add_argument("-r", "--run_duration", required=True, type=float,
-            help="Duration expected for run (main) phase (after initialization phase)")
+            help="Duration expected for run (main) phase (measured from the end of "
+                    "the initialization phase)")
     profile_parser.add_argument("-c", "--command", required=True,
             help="The path to the benchmark to run")
     profile_parser.set_defaults(func=do_profile)
 
+    # `sweep` subcommand
+    sweep_parser = subparsers.add_parser("sweep",
+            help="Time a list of benchmarks back-to-back, as with `time`")
+    sweep_parser.add_argument("-f", "--file", required=True,
+            help="File listing the benchmarks to run, one command per line")
+    sweep_parser.set_defaults(func=do_sweep)
+
     args = parser.parse_args()
 
     if args.command:
@@ -1,13 +1,30 @@
 #!/usr/bin/env python
 import csv
-from copy import deepcopy
-from scipy.stats import hmean
+import sys
+import numpy as np
+
+# numba is optional: if it's installed, the per-benchmark math is JIT-compiled
+# (and cached on disk); otherwise it runs as plain NumPy
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda f: f
 
 # Computes and summarizes statistics from the supplied CSV file.
 
 # CSV header (for reference):
 # BENCHMARK,CLASS,ARCH,INIT_TIME,RUN_TIME,OPS_MOPS_S,MEM_BW_RD_GB_S,MEM_BW_WR_GB_S,
 CSV_FILEPATH = './data.csv'
+# the columns we actually use, and the dtypes to parse them as
+CSV_COLUMNS = [
+    ('BENCHMARK', 'U16'),
+    ('CLASS', 'U16'),
+    ('ARCH', 'U16'),
+    ('OPS_MOPS_S', 'f8'),
+    ('MEM_BW_RD_GB_S', 'f8'),
+    ('MEM_BW_WR_GB_S', 'f8'),
+]
 
 # used for computing energy breakdowns
 power_w = {
@@ -20,66 +37,104 @@ mem_energy_pj_bit = {
     'gpu': 5.9,
 }
 
+# (power_w, mem_energy_pj_bit, power in nJ/s) per arch, precomputed once
+ARCH_CONST = {arch: (power_w[arch], mem_energy_pj_bit[arch], power_w[arch] * 1e9)
+        for arch in power_w}
 
-def do_individual():
-    # keep running arrays of values so we can take the h-mean at the end
-    inner = {
-        'g_ops_s': [],
-        'mem_bw_gib_s': [],
-        'bytes_op': [],
-        'nj_op': [],
-        'cmp_power_w': [],
-        'mem_power_w': [],
-    }
-    data = {
-        'cpu': deepcopy(inner),
-        'gpu': deepcopy(inner),
-    }
 
-    with open(CSV_FILEPATH, 'r') as f:
-        reader = csv.DictReader(f)
+# harmonic mean of a positive float vector; all of our metrics are > 0
+def hmean(v):
+    return v.size / np.reciprocal(v).sum()
 
-        print(f"{'-'*25} per-benchmark {'-'*25}")
 
-        for row in reader:
-            benchmark = row['BENCHMARK']
-            benchmark_class = row['CLASS']
-            arch = row['ARCH']
+# derives the per-benchmark metrics from the raw columns, given each row's
+# model constants
+@njit(cache=True, fastmath=True)
+def compute(m_ops_s, mem_bw_rd_gb_s, mem_bw_wr_gb_s, arch_power_w, arch_mem_energy_pj_bit,
+        arch_power_nj_s):
+    g_ops_s = m_ops_s / 1e3
 
-            m_ops_s = float(row['OPS_MOPS_S'])
-            g_ops_s = m_ops_s / 1e3
+    mem_bw_bytes_s = (mem_bw_rd_gb_s + mem_bw_wr_gb_s) * 1e9
+    mem_bw_gib_s = mem_bw_bytes_s / 1024**3
 
-            mem_bw_rd_bytes_s = float(row['MEM_BW_RD_GB_S']) * 1e9
-            mem_bw_wr_bytes_s = float(row['MEM_BW_WR_GB_S']) * 1e9
-            mem_bw_bytes_s = mem_bw_rd_bytes_s + mem_bw_wr_bytes_s
-            mem_bw_gib_s = mem_bw_bytes_s / 1024**3
+    mem_bw_bits_s = mem_bw_bytes_s * 8
+    mem_power_w = mem_bw_bits_s * arch_mem_energy_pj_bit * 1e-12
+    cmp_power_w = arch_power_w - mem_power_w
 
-            mem_bw_bits_s = mem_bw_bytes_s * 8
-            mem_power_w = mem_bw_bits_s * mem_energy_pj_bit[arch] * 1e-12
-            cmp_power_w = power_w[arch] - mem_power_w
+    ops_s = m_ops_s * 1e6
 
-            ops_s = m_ops_s * 1e6
+    bytes_op = mem_bw_bytes_s / ops_s
 
-            bytes_op = mem_bw_bytes_s / ops_s
+    nj_op = arch_power_nj_s / ops_s
 
-            power_nj_s = power_w[arch] * 1e9
-            nj_op = power_nj_s / ops_s
+    return g_ops_s, mem_bw_gib_s, bytes_op, nj_op, cmp_power_w, mem_power_w
 
-            data[arch]['g_ops_s'].append(g_ops_s)
-            data[arch]['mem_bw_gib_s'].append(mem_bw_gib_s)
-            data[arch]['bytes_op'] .append(bytes_op)
-            data[arch]['nj_op'] .append(nj_op)
-            data[arch]['cmp_power_w'].append(cmp_power_w)
-            data[arch]['mem_power_w'].append(mem_power_w)
 
-            print(f"[{arch}] {benchmark}.{benchmark_class}: "
-                    f"{g_ops_s:.2f} G ops/s "
-                    f"| {mem_bw_gib_s:.2f} GiB/s "
-                    f"| {bytes_op:.2f} bytes/op "
-                    f"| {nj_op:.2f} nJ/op"
-                    f"| {cmp_power_w:.2f} W (compute) "
-                    f"| {mem_power_w:.2f} W (memory) "
-            )
+def do_individual():
+    # resolve the column positions from the header, then let NumPy's C parser
+    # read just those columns, with their dtypes pinned
+    with open(CSV_FILEPATH, 'r') as f:
+        header = next(csv.reader(f))
+    c = {name: i for i, name in enumerate(header)}
+
+    table = np.loadtxt(CSV_FILEPATH, delimiter=',', skiprows=1, ndmin=1,
+            usecols=[c[name] for name, _ in CSV_COLUMNS], dtype=CSV_COLUMNS)
+
+    benchmark = table['BENCHMARK']
+    benchmark_class = table['CLASS']
+    arch = table['ARCH']
+
+    # copy the numeric fields out of the record array so each is contiguous
+    m_ops_s = np.ascontiguousarray(table['OPS_MOPS_S'])
+    mem_bw_rd_gb_s = np.ascontiguousarray(table['MEM_BW_RD_GB_S'])
+    mem_bw_wr_gb_s = np.ascontiguousarray(table['MEM_BW_WR_GB_S'])
+
+    # per-row model constants, according to each row's architecture; look each
+    # architecture's constants up once, then gather them out per row
+    archs, arch_idx = np.unique(arch, return_inverse=True)
+    arch_const = np.array([ARCH_CONST[a] for a in archs])
+    arch_power_w, arch_mem_energy_pj_bit, arch_power_nj_s = arch_const[arch_idx].T.copy()
+
+    g_ops_s, mem_bw_gib_s, bytes_op, nj_op, cmp_power_w, mem_power_w = compute(m_ops_s,
+            mem_bw_rd_gb_s, mem_bw_wr_gb_s, arch_power_w, arch_mem_energy_pj_bit,
+            arch_power_nj_s)
+
+    print(f"{'-'*25} per-benchmark {'-'*25}")
+
+    # format every row from one template and write them out in batches, rather
+    # than one print() per row
+    fmt = ("[%s] %s.%s: "
+            "%.2f G ops/s "
+            "| %.2f GiB/s "
+            "| %.2f bytes/op "
+            "| %.2f nJ/op"
+            "| %.2f W (compute) "
+            "| %.2f W (memory) ")
+    rows = zip(arch, benchmark, benchmark_class, g_ops_s.tolist(), mem_bw_gib_s.tolist(),
+            bytes_op.tolist(), nj_op.tolist(), cmp_power_w.tolist(), mem_power_w.tolist())
+
+    lines = []
+    for row in rows:
+        lines.append(fmt % row)
+        if len(lines) == 256:
+            sys.stdout.write('\n'.join(lines))
+            sys.stdout.write('\n')
+            lines.clear()
+    if lines:
+        sys.stdout.write('\n'.join(lines))
+        sys.stdout.write('\n')
+
+    # split each derived column by architecture so we can take the h-means
+    cols = {
+        'g_ops_s': g_ops_s,
+        'mem_bw_gib_s': mem_bw_gib_s,
+        'bytes_op': bytes_op,
+        'nj_op': nj_op,
+        'cmp_power_w': cmp_power_w,
+        'mem_power_w': mem_power_w,
+    }
+    masks = {a: arch == a for a in ('cpu', 'gpu')}
+    data = {a: {col: vals[mask] for col, vals in cols.items()} for a, mask in masks.items()}
 
     return data
 
@@ -99,7 +154,7 @@ def do_avg_power(data):
     print(f"{'-'*25} avg. power {'-'*25}")
 
     for arch in ['cpu', 'gpu']:
-        avg_cmp_power_w = sum(data[arch]['cmp_power_w']) / len(data[arch]['cmp_power_w'])
+        avg_cmp_power_w = data[arch]['cmp_power_w'].mean()
         avg_mem_power_w = power_w[arch] - avg_cmp_power_w
         pct_mem_power = (avg_mem_power_w / power_w[arch]) * 100.0
 